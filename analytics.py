@@ -1,116 +1,427 @@
 # analytics.py
+import atexit
+import functools
 import sqlite3
-from datetime import datetime
-from typing import Dict, List
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 from pathlib import Path
 
+# Averages come from the running-stats tables, which are O(distinct keys)
+# instead of O(interactions)
+TECHNIQUE_STATS_SQL = """
+    SELECT
+        t.name as technique_name,
+        SUM(s.uses) as uses,
+        CAST(SUM(s.sum_rating) AS REAL) / SUM(s.uses) as avg_rating,
+        CAST(SUM(s.sum_tokens) AS REAL) / NULLIF(SUM(s.n_tokens), 0) as avg_tokens,
+        CAST(SUM(s.sum_response_ms) AS REAL) / NULLIF(SUM(s.n_response_ms), 0) as avg_response_time
+    FROM technique_stats s
+    JOIN techniques t ON t.id = s.technique_fk
+    GROUP BY t.name
+    ORDER BY uses DESC
+"""
+
+PROVIDER_COMPARISON_SQL = """
+    SELECT
+        p.name as provider,
+        SUM(s.uses) as uses,
+        CAST(SUM(s.sum_rating) AS REAL) / SUM(s.uses) as avg_rating,
+        CAST(SUM(s.sum_tokens) AS REAL) / NULLIF(SUM(s.n_tokens), 0) as avg_tokens,
+        CAST(SUM(s.sum_response_ms) AS REAL) / NULLIF(SUM(s.n_response_ms), 0) as avg_response_time
+    FROM provider_stats s
+    JOIN providers p ON p.id = s.provider_fk
+    GROUP BY p.name
+"""
+
+RECENT_HISTORY_SQL = """
+    SELECT i.timestamp, i.query, t.name as technique_name, p.name as provider,
+           i.user_rating, i.tokens_used
+    FROM interactions i
+    JOIN techniques t ON t.id = i.technique_fk
+    JOIN providers p ON p.id = i.provider_fk
+    ORDER BY i.timestamp DESC, i.id DESC
+    LIMIT ?
+"""
+
+# Shared by every flush so sqlite3 reuses the cached prepared statements
+INSERT_INTERACTION_SQL = """
+    INSERT INTO interactions
+    (timestamp, query, technique_fk, provider_fk,
+     user_rating, tokens_used, input_tokens, output_tokens, response_time_ms)
+    VALUES (strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'),
+            ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_RESPONSE_SQL = "INSERT INTO responses (interaction_id, response) VALUES (?, ?)"
+
+# Running sums over rated interactions; n_* count non-NULL values so the
+# averages match SQL AVG() semantics
+STATS_COLUMNS = """
+        uses INTEGER NOT NULL,
+        sum_rating INTEGER NOT NULL,
+        sum_tokens INTEGER NOT NULL,
+        n_tokens INTEGER NOT NULL,
+        sum_response_ms INTEGER NOT NULL,
+        n_response_ms INTEGER NOT NULL
+"""
+
+STATS_UPSERT_SQL = """
+    INSERT INTO {table} ({key}, uses, sum_rating, sum_tokens, n_tokens, sum_response_ms, n_response_ms)
+    VALUES (?, 1, ?, ?, ?, ?, ?)
+    ON CONFLICT({key}) DO UPDATE SET
+        uses = uses + 1,
+        sum_rating = sum_rating + excluded.sum_rating,
+        sum_tokens = sum_tokens + excluded.sum_tokens,
+        n_tokens = n_tokens + excluded.n_tokens,
+        sum_response_ms = sum_response_ms + excluded.sum_response_ms,
+        n_response_ms = n_response_ms + excluded.n_response_ms
+"""
+
+STATS_BACKFILL_SQL = """
+    INSERT INTO {table} ({key}, uses, sum_rating, sum_tokens, n_tokens, sum_response_ms, n_response_ms)
+    SELECT {key}, COUNT(*), SUM(user_rating),
+           COALESCE(SUM(tokens_used), 0), COUNT(tokens_used),
+           COALESCE(SUM(response_time_ms), 0), COUNT(response_time_ms)
+    FROM interactions
+    WHERE user_rating IS NOT NULL
+    GROUP BY {key}
+"""
+
+STATS_TABLES = {
+    "technique_stats": "technique_fk",
+    "provider_stats": "provider_fk"
+}
+
+INTERACTIONS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS interactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        query TEXT NOT NULL,
+        technique_fk INTEGER NOT NULL REFERENCES techniques(id),
+        provider_fk INTEGER NOT NULL REFERENCES providers(id),
+        user_rating INTEGER,
+        tokens_used INTEGER,
+        input_tokens INTEGER,
+        output_tokens INTEGER,
+        response_time_ms INTEGER,
+        metadata TEXT
+    )
+"""
+
+# Large response text is kept out of the analytics rows
+RESPONSES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        interaction_id INTEGER PRIMARY KEY REFERENCES interactions(id),
+        response TEXT
+    )
+"""
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path: str):
+    """Create a directory once per process"""
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+def _flush_at_exit(tracker_ref: weakref.ref):
+    """atexit hook holding only a weak reference, so replaced trackers can be collected"""
+    tracker = tracker_ref()
+    if tracker is not None:
+        tracker.flush()
+
 class AnalyticsTracker:
     """Track and analyze prompt performance"""
 
     def __init__(self, db_path: str = "./data/performance.db"):
         self.db_path = db_path
         # Ensure the directory exists
-        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        _ensure_dir(str(Path(self.db_path).parent))
+        # One writer and one read-only connection, each shared across
+        # Streamlit script-runner threads behind its own lock
+        self._lock = threading.Lock()
+        self._conn = self._connect()
         self._init_db()
+        self._read_lock = threading.Lock()
+        self._ro_conn = self._connect(read_only=True)
+        # Rows are buffered and written in one transaction on flush
+        self._pending: List[tuple] = []
+        self._flush_threshold = 50
+        # String -> INTEGER key caches for the lookup tables
+        self._technique_ids: Dict[Tuple[str, str], int] = {}
+        self._provider_ids: Dict[str, int] = {}
+        # Bumped on every write so callers can key caches on it
+        self.write_epoch = 0
+        atexit.register(_flush_at_exit, weakref.ref(self))
+
+    def __del__(self):
+        # A tracker replaced without an explicit flush still writes its buffered rows
+        self.flush()
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open an autocommit connection with per-connection PRAGMAs applied"""
+        if read_only:
+            # Under WAL a read-only reader never takes the write lock
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        # These settings are not persisted in the database file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
 
     def _init_db(self):
         """Initialize database schema"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS interactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                query TEXT NOT NULL,
-                technique_id TEXT NOT NULL,
-                technique_name TEXT NOT NULL,
-                provider TEXT NOT NULL,
-                response TEXT,
-                user_rating INTEGER,
-                tokens_used INTEGER,
-                input_tokens INTEGER,
-                output_tokens INTEGER,
-                response_time_ms INTEGER,
-                metadata TEXT
-            )
-        """)
+        with self._lock:
+            cursor = self._conn.cursor()
+
+            # WAL is persistent: one sequential log write per commit and readers
+            # don't block on the writer
+            cursor.execute("PRAGMA journal_mode=WAL")
+
+            # Low-cardinality strings live in lookup tables; interactions stores INTEGER keys
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS techniques (
+                    id INTEGER PRIMARY KEY,
+                    tech_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    UNIQUE (tech_id, name)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS providers (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )
+            """)
+
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(interactions)")}
+            if 'technique_name' in columns:
+                self._migrate_string_columns(cursor)
+            else:
+                cursor.execute(INTERACTIONS_SCHEMA)
+            # Created only once the final interactions table exists: renaming a table
+            # rewrites foreign keys that point at it
+            cursor.execute(RESPONSES_SCHEMA)
 
-        conn.commit()
-        conn.close()
+            existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table, key in STATS_TABLES.items():
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        {key} INTEGER PRIMARY KEY,{STATS_COLUMNS}
+                    )
+                """)
+                if table not in existing:
+                    cursor.execute(STATS_BACKFILL_SQL.format(table=table, key=key))
+
+            has_index = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_ts_desc'"
+            ).fetchone()
+            if not has_index:
+                cursor.execute("CREATE INDEX idx_ts_desc ON interactions(timestamp DESC)")
+                # ANALYZE scans every row, so only pay for it when the index is new
+                cursor.execute("ANALYZE")
+
+    def _migrate_string_columns(self, cursor: sqlite3.Cursor):
+        """Rewrite a pre-lookup-table interactions table to use INTEGER keys"""
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute("""
+                INSERT OR IGNORE INTO techniques (tech_id, name)
+                SELECT DISTINCT technique_id, technique_name FROM interactions
+            """)
+            cursor.execute("""
+                INSERT OR IGNORE INTO providers (name)
+                SELECT DISTINCT provider FROM interactions
+            """)
+            cursor.execute("ALTER TABLE interactions RENAME TO interactions_legacy")
+            cursor.execute(INTERACTIONS_SCHEMA)
+            cursor.execute(RESPONSES_SCHEMA)
+            cursor.execute("""
+                INSERT INTO responses (interaction_id, response)
+                SELECT id, response FROM interactions_legacy WHERE response IS NOT NULL
+            """)
+            cursor.execute("""
+                INSERT INTO interactions
+                (id, timestamp, query, technique_fk, provider_fk, user_rating,
+                 tokens_used, input_tokens, output_tokens, response_time_ms, metadata)
+                SELECT l.id, l.timestamp, l.query, t.id, p.id, l.user_rating,
+                       l.tokens_used, l.input_tokens, l.output_tokens, l.response_time_ms, l.metadata
+                FROM interactions_legacy l
+                JOIN techniques t ON t.tech_id = l.technique_id AND t.name = l.technique_name
+                JOIN providers p ON p.name = l.provider
+            """)
+            # Drops the legacy indexes along with the table
+            cursor.execute("DROP TABLE interactions_legacy")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
 
     def log_interaction(self, query: str, technique_id: str, technique_name: str,
                        provider: str, response: str, tokens: Dict,
                        response_time: int, rating: int = None):
-        """Log a single interaction"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            INSERT INTO interactions
-            (timestamp, query, technique_id, technique_name, provider, response,
-             user_rating, tokens_used, input_tokens, output_tokens, response_time_ms)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            datetime.now().isoformat(),
-            query, technique_id, technique_name, provider, response,
-            rating, tokens.get('tokens', 0), tokens.get('input_tokens', 0),
-            tokens.get('output_tokens', 0), response_time
-        ))
-
-        conn.commit()
-        conn.close()
+        """Log a single interaction (buffered until the next flush)"""
+        with self._lock:
+            self._pending.append((
+                query, technique_id, technique_name, provider, response,
+                rating, tokens.get('tokens', 0), tokens.get('input_tokens', 0),
+                tokens.get('output_tokens', 0), response_time
+            ))
+            self.write_epoch += 1
+            if len(self._pending) >= self._flush_threshold:
+                self._flush_locked()
+
+    def flush(self):
+        """Write all buffered interactions to the database"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        """Write buffered rows in a single transaction; caller holds the lock"""
+        if not self._pending:
+            return
+
+        # Keys allocated inside the transaction are only cached once it commits
+        new_technique_ids: Dict[Tuple[str, str], int] = {}
+        new_provider_ids: Dict[str, int] = {}
+
+        self._conn.execute("BEGIN")
+        try:
+            rows = []
+            responses = []
+            for (query, technique_id, technique_name, provider, response, *rest) in self._pending:
+                technique_fk = self._lookup_id(
+                    "techniques", ("tech_id", "name"), (technique_id, technique_name),
+                    self._technique_ids, new_technique_ids
+                )
+                provider_fk = self._lookup_id(
+                    "providers", ("name",), provider,
+                    self._provider_ids, new_provider_ids
+                )
+                rows.append((query, technique_fk, provider_fk, *rest))
+                responses.append(response)
+
+            self._conn.executemany(INSERT_INTERACTION_SQL, rows)
+            self._update_running_stats(rows)
+
+            # AUTOINCREMENT ids are consecutive while this transaction holds the write lock
+            last_id = self._conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'interactions'"
+            ).fetchone()[0]
+            first_id = last_id - len(rows) + 1
+            self._conn.executemany(
+                INSERT_RESPONSE_SQL,
+                [(first_id + i, response) for i, response in enumerate(responses)
+                 if response is not None]
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._technique_ids.update(new_technique_ids)
+        self._provider_ids.update(new_provider_ids)
+        self._pending.clear()
+
+    def _update_running_stats(self, rows: List[tuple]):
+        """Fold rated rows into the running-stats tables; caller holds the lock"""
+        technique_updates = []
+        provider_updates = []
+        for (_, technique_fk, provider_fk, rating, tokens_used, _, _, response_time) in rows:
+            if rating is None:
+                continue
+            sums = (
+                rating,
+                tokens_used or 0, int(tokens_used is not None),
+                response_time or 0, int(response_time is not None)
+            )
+            technique_updates.append((technique_fk, *sums))
+            provider_updates.append((provider_fk, *sums))
+
+        if technique_updates:
+            self._conn.executemany(
+                STATS_UPSERT_SQL.format(table="technique_stats", key="technique_fk"),
+                technique_updates
+            )
+            self._conn.executemany(
+                STATS_UPSERT_SQL.format(table="provider_stats", key="provider_fk"),
+                provider_updates
+            )
+
+    def _lookup_id(self, table: str, columns: Tuple[str, ...], key, cache: Dict, new_ids: Dict) -> int:
+        """Resolve a lookup-table key to its INTEGER id, inserting it if missing"""
+        if key in cache:
+            return cache[key]
+        if key in new_ids:
+            return new_ids[key]
+
+        values = key if isinstance(key, tuple) else (key,)
+        where = " AND ".join(f"{col} = ?" for col in columns)
+        row = self._conn.execute(f"SELECT id FROM {table} WHERE {where}", values).fetchone()
+        if row:
+            cache[key] = row[0]
+            return row[0]
+
+        placeholders = ", ".join("?" for _ in columns)
+        cursor = self._conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", values
+        )
+        new_ids[key] = cursor.lastrowid
+        return cursor.lastrowid
+
+    def _query_df(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        """Run a query and build the DataFrame straight from the fetched rows; caller holds the read lock"""
+        cursor = self._ro_conn.execute(sql, params)
+        columns = [col[0] for col in cursor.description]
+        return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
 
     def get_technique_stats(self) -> pd.DataFrame:
         """Get statistics by technique"""
-        conn = sqlite3.connect(self.db_path)
-
-        df = pd.read_sql_query("""
-            SELECT
-                technique_name,
-                COUNT(*) as uses,
-                AVG(user_rating) as avg_rating,
-                AVG(tokens_used) as avg_tokens,
-                AVG(response_time_ms) as avg_response_time
-            FROM interactions
-            WHERE user_rating IS NOT NULL
-            GROUP BY technique_name
-            ORDER BY uses DESC
-        """, conn)
-
-        conn.close()
-        return df
+        self.flush()
+        with self._read_lock:
+            return self._query_df(TECHNIQUE_STATS_SQL)
 
     def get_provider_comparison(self) -> pd.DataFrame:
         """Compare providers"""
-        conn = sqlite3.connect(self.db_path)
-
-        df = pd.read_sql_query("""
-            SELECT
-                provider,
-                COUNT(*) as uses,
-                AVG(user_rating) as avg_rating,
-                AVG(tokens_used) as avg_tokens,
-                AVG(response_time_ms) as avg_response_time
-            FROM interactions
-            WHERE user_rating IS NOT NULL
-            GROUP BY provider
-        """, conn)
-
-        conn.close()
-        return df
+        self.flush()
+        with self._read_lock:
+            return self._query_df(PROVIDER_COMPARISON_SQL)
 
     def get_recent_history(self, limit: int = 20) -> pd.DataFrame:
         """Get recent interactions"""
-        conn = sqlite3.connect(self.db_path)
+        self.flush()
+        with self._read_lock:
+            return self._query_df(RECENT_HISTORY_SQL, (int(limit),))
+
+    def get_response(self, interaction_id: int) -> Optional[str]:
+        """Get the full response text for an interaction"""
+        self.flush()
+        with self._read_lock:
+            row = self._ro_conn.execute(
+                "SELECT response FROM responses WHERE interaction_id = ?", (interaction_id,)
+            ).fetchone()
+        return row[0] if row else None
 
-        df = pd.read_sql_query(f"""
-            SELECT timestamp, query, technique_name, provider, user_rating, tokens_used
-            FROM interactions
-            ORDER BY timestamp DESC
-            LIMIT {limit}
-        """, conn)
+    def get_interaction_count(self) -> int:
+        """Get the total number of logged interactions"""
+        self.flush()
+        with self._read_lock:
+            return self._ro_conn.execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
 
-        conn.close()
-        return df
+    def get_dashboard(self, history_limit: int = 50) -> Dict[str, pd.DataFrame]:
+        """Get technique stats, provider comparison and recent history in one pass"""
+        self.flush()
+        with self._read_lock:
+            # One read transaction so all three results come from the same snapshot
+            self._ro_conn.execute("BEGIN")
+            try:
+                return {
+                    "techniques": self._query_df(TECHNIQUE_STATS_SQL),
+                    "providers": self._query_df(PROVIDER_COMPARISON_SQL),
+                    "history": self._query_df(RECENT_HISTORY_SQL, (int(history_limit),))
+                }
+            finally:
+                self._ro_conn.execute("COMMIT")
@@ -1,11 +1,22 @@
 # app.py
 import streamlit as st
+import os
 import time
+import uuid
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import streamlit.components.v1 as st_components
+import plotly.express as px
+import plotly.graph_objects as go
 
-from providers import MultiProviderClient
-from scaffold_engine import ScaffoldEngine
+from providers import MultiProviderClient, get_env
+from scaffold_engine import ReformulationFailed, ScaffoldEngine
 from analytics import AnalyticsTracker
 from exporter import ClaudeCodeExporter
 from pdf_viewer import PDFSourceViewer
@@ -17,30 +28,25 @@ st.set_page_config(
     layout="wide"
 )
 
-# === INITIALIZE COMPONENTS ===
-@st.cache_resource
-def init_components():
-    return {
-        'client': MultiProviderClient(),
-        'engine': ScaffoldEngine(),
-        'analytics': AnalyticsTracker(),
-        'exporter': ClaudeCodeExporter(),
-        'pdf_viewer': PDFSourceViewer()
-    }
+RESPONSE_STORE_SESSIONS = 256
+# Similarity-distance cutoffs (lower is better) and their labels
+MATCH_QUALITY_THRESHOLDS = (0.3, 0.5)
+MATCH_QUALITY_LABELS = ("Excellent", "Good", "Fair")
 
+# === INITIALIZE COMPONENTS ===
 # Add cache buster based on API keys to reinitialize when keys change
 try:
-    import streamlit as st_check
-    if hasattr(st_check, 'secrets'):
-        # Use presence of keys as cache buster
-        cache_key = f"{bool(st.secrets.get('ANTHROPIC_API_KEY'))}{bool(st.secrets.get('OPENAI_API_KEY'))}{bool(st.secrets.get('XAI_API_KEY'))}"
-    else:
-        cache_key = "local"
-except:
+    # Use presence of keys as cache buster
+    cache_key = "".join("1" if st.secrets.get(k) else "0"
+                        for k in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "XAI_API_KEY"))
+except FileNotFoundError:
+    # No secrets.toml (local development with .env)
     cache_key = "local"
 
 @st.cache_resource
 def init_components_with_key(_cache_key):
+    # Keys changed (or cache was cleared): drop memoised env/secrets lookups
+    get_env.cache_clear()
     return {
         'client': MultiProviderClient(),
         'engine': ScaffoldEngine(),
@@ -51,31 +57,192 @@ def init_components_with_key(_cache_key):
 
 components = init_components_with_key(cache_key)
 
+# Analytics queries only change when a write happens, so key them on the write epoch
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_dashboard(db_path, write_epoch):
+    return components['analytics'].get_dashboard(history_limit=50)
+
+# Figures depend only on the dashboard data, so share its write-epoch key.
+# cache_resource avoids unpickling a figure copy on every rerun.
+@st.cache_resource(max_entries=4, show_spinner=False)
+def cached_analytics_figures(db_path, write_epoch):
+    dashboard = cached_dashboard(db_path, write_epoch)
+    stats = dashboard['techniques']
+    provider_stats = dashboard['providers']
+    return {
+        'technique_bar': px.bar(
+            stats,
+            x='technique_name',
+            y='uses',
+            color='avg_rating',
+            title='Technique Usage & Ratings',
+            labels={'uses': 'Times Used', 'avg_rating': 'Avg Rating'},
+            color_continuous_scale='Viridis'
+        ),
+        'provider_pie': px.pie(
+            provider_stats,
+            values='uses',
+            names='provider',
+            title='Usage Distribution'
+        ),
+        'provider_bar': px.bar(
+            provider_stats,
+            x='provider',
+            y='avg_rating',
+            title='Average Ratings',
+            color='avg_rating',
+            color_continuous_scale='RdYlGn'
+        )
+    }
+
+@st.cache_data(ttl=10, show_spinner=False)
+def cached_interaction_count(db_path):
+    return components['analytics'].get_interaction_count()
+
+# Secret introspection for the sidebar debug panel (key names and presence only, never values)
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_debug_snapshot():
+    try:
+        return {
+            "keys_in_secrets": list(st.secrets.keys()),
+            "XAI_API_KEY in secrets": 'XAI_API_KEY' in st.secrets,
+            "ANTHROPIC_API_KEY in secrets": 'ANTHROPIC_API_KEY' in st.secrets,
+            "OPENAI_API_KEY in secrets": 'OPENAI_API_KEY' in st.secrets,
+            "get_env('XAI_API_KEY') is set": bool(get_env("XAI_API_KEY"))
+        }
+    except Exception as e:
+        return {"debug_error": str(e)}
+
+# Provider lookups are static for a given set of components. KB category lookups
+# are already O(1) on the engine, so they are called directly.
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_providers(cache_key):
+    return components['client'].get_available_providers()
+
+# cache_resource hands back the same dict instead of unpickling a copy per rerun
+@st.cache_resource(show_spinner=False)
+def technique_options_labeled():
+    return {f"{t['name']} ({t['category']})": t for t in components['engine'].kb}
+
+# Reformulation calls an LLM, so never rebuild a scaffold for inputs we've already seen.
+# A failed reformulation raises instead, and Streamlit doesn't cache exceptions.
+@st.cache_data(show_spinner=False, max_entries=128)
+def cached_build_scaffold(query, technique_id=None, use_reformulation=True):
+    return components['engine'].build_scaffold(
+        query,
+        technique_id=technique_id,
+        use_reformulation=use_reformulation,
+        raise_on_fallback=True
+    )
+
+def build_scaffold(query, technique_id=None, use_reformulation=True):
+    """Cached scaffold build; a fallback from a failed reformulation is used but not cached"""
+    try:
+        return cached_build_scaffold(query, technique_id=technique_id, use_reformulation=use_reformulation)
+    except ReformulationFailed as e:
+        return e.scaffold, e.technique
+
+# Keyed on the source file's mtime so replaced or newly added files are picked up.
+# Kept in memory only: pdf_viewer already caches the parsed page text.
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_source_content(cite, mtime):
+    return components['pdf_viewer'].get_source_content(cite)
+
+# Keyed on mtime so edits to the file are picked up
+@st.cache_data(show_spinner=False)
+def cached_text_file(path, mtime):
+    return Path(path).read_text(encoding='utf-8')
+
+# Export scaffolds always use the same placeholder query, so they only depend on the technique
+@st.cache_data(show_spinner=False)
+def cached_example_scaffold(technique_id):
+    scaffold, _ = components['engine'].build_scaffold("Example query", technique_id=technique_id,
+                                                      raise_on_fallback=True)
+    return scaffold
+
+def example_scaffold(technique_id):
+    """Cached example scaffold; a fallback from a failed reformulation is used but not cached"""
+    try:
+        return cached_example_scaffold(technique_id)
+    except ReformulationFailed as e:
+        return e.scaffold
+
+def export_techniques(techniques):
+    """Build example scaffolds concurrently and export them as command files"""
+    scaffolds = dict(run_concurrently(example_scaffold, [t['id'] for t in techniques]))
+    exported = components['exporter'].export_batch([
+        {'technique': tech, 'scaffold': scaffolds[tech['id']]} for tech in techniques
+    ])
+    components['exporter'].create_readme(exported)
+    return exported
+
+@st.cache_resource
+def response_store():
+    # session id -> {slot: response data}, least recently active session first
+    return threading.Lock(), OrderedDict()
+
+def session_responses():
+    """
+    This session's response slots, kept out of session state so reruns don't diff large bodies
+    Only the RESPONSE_STORE_SESSIONS most recently active sessions are kept, so a session left
+    idle while that many others run loses its stored responses until it runs again
+    """
+    lock, sessions = response_store()
+    session_id = get_script_run_ctx().session_id
+    with lock:
+        slots = sessions.setdefault(session_id, {})
+        sessions.move_to_end(session_id)
+        while len(sessions) > RESPONSE_STORE_SESSIONS:
+            sessions.popitem(last=False)
+    return slots
+
+def run_concurrently(func, items):
+    """Run func over items on worker threads, yielding (item, result) as each finishes"""
+    ctx = get_script_run_ctx()
+
+    def run(item):
+        # Worker threads need the script context to use st.cache_data
+        add_script_run_ctx(ctx=ctx)
+        return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(len(items), 8)) as executor:
+        futures = {executor.submit(run, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def copy_scaffold_button(text):
+    """Render a button that copies text to the clipboard client-side"""
+    # Escape "</" so scaffold content can't close the script tag early
+    payload = json.dumps(text).replace("</", "<\\/")
+    st_components.html(f"""
+        <button id="copy" style="width:100%;padding:0.4rem;border:1px solid rgba(49,51,63,0.2);
+            border-radius:0.5rem;background:white;cursor:pointer;font-family:sans-serif;">📋 Copy Scaffold</button>
+        <script>
+            const text = {payload};
+            const button = document.getElementById("copy");
+            button.addEventListener("click", () => {{
+                navigator.clipboard.writeText(text).then(() => {{ button.textContent = "✅ Copied!"; }});
+            }});
+        </script>
+    """, height=45)
+
 # === SESSION STATE ===
-if 'scaffold' not in st.session_state:
-    st.session_state.scaffold = ""
-if 'responses' not in st.session_state:
-    st.session_state.responses = {}
-if 'technique' not in st.session_state:
-    st.session_state.technique = None
-if 'comparison_mode' not in st.session_state:
-    st.session_state.comparison_mode = False
-if 'last_query' not in st.session_state:
-    st.session_state.last_query = ""
-if 'comparison_results' not in st.session_state:
-    st.session_state.comparison_results = {}
-if 'comparison_type' not in st.session_state:
-    st.session_state.comparison_type = None
-if 'comparison_technique' not in st.session_state:
-    st.session_state.comparison_technique = None
-if 'last_mode' not in st.session_state:
-    st.session_state.last_mode = "🎯 Single Query"
-if 'last_provider' not in st.session_state:
-    st.session_state.last_provider = None
-if 'last_temperature' not in st.session_state:
-    st.session_state.last_temperature = 0.7
-if 'last_max_tokens' not in st.session_state:
-    st.session_state.last_max_tokens = 2048
+DEFAULT_STATE = {
+    'scaffold': "",
+    'technique': None,
+    'comparison_mode': False,
+    'last_query': "",
+    'comparison_type': None,
+    'comparison_technique': None,
+    'comparison_run_id': None,
+    'last_mode': "🎯 Single Query",
+    'last_provider': None,
+    'last_temperature': 0.7,
+    'last_max_tokens': 2048,
+    'streamed_reformulations': set()
+}
+for key, value in DEFAULT_STATE.items():
+    st.session_state.setdefault(key, value)
 
 # === HEADER ===
 st.title("🔬 Multi-Provider Prompt Scaffold Inspector")
@@ -86,7 +253,7 @@ with st.sidebar:
     st.header("⚙️ Configuration")
 
     # Provider selection
-    available_providers = components['client'].get_available_providers()
+    available_providers = cached_providers(cache_key)
     if not available_providers:
         st.error("⚠️ No API keys configured! Check your .env file")
         st.info("""
@@ -115,30 +282,19 @@ with st.sidebar:
 
             # Cache clear button
             if st.button("🔄 Clear Cache & Reload Providers"):
-                st.cache_resource.clear()
+                # The rebuilt tracker can't see this one's buffered ratings, so write them first
+                components['analytics'].flush()
+                # Rebuild the components and what was derived from them; the session
+                # response stores belong to users, not to the components, so they stay
+                init_components_with_key.clear()
+                technique_options_labeled.clear()
+                cached_analytics_figures.clear()
+                st.cache_data.clear()
                 st.rerun()
 
             # Debug info
             if st.checkbox("🔍 Show Debug Info"):
-                import os
-                try:
-                    import streamlit as st_check
-                    has_secrets = hasattr(st_check, 'secrets')
-                    st.caption(f"Streamlit secrets available: {has_secrets}")
-                    if has_secrets:
-                        # Show which keys are in secrets (without revealing values)
-                        secret_keys = list(st.secrets.keys()) if has_secrets else []
-                        st.caption(f"Keys in secrets: {secret_keys}")
-                        st.caption(f"XAI_API_KEY in secrets: {'XAI_API_KEY' in st.secrets}")
-                        st.caption(f"ANTHROPIC_API_KEY in secrets: {'ANTHROPIC_API_KEY' in st.secrets}")
-                        st.caption(f"OPENAI_API_KEY in secrets: {'OPENAI_API_KEY' in st.secrets}")
-
-                        # Test get_env function directly
-                        from providers import get_env
-                        xai_test = get_env("XAI_API_KEY")
-                        st.caption(f"get_env('XAI_API_KEY') returns: {xai_test[:10] if xai_test else 'None'}...")
-                except Exception as e:
-                    st.caption(f"Debug error: {e}")
+                st.json(cached_debug_snapshot())
 
     # Mode selection
     mode = st.radio(
@@ -167,16 +323,21 @@ if mode == "🎯 Single Query":
     col1, col2 = st.columns([2, 1])
 
     with col1:
-        user_input = st.text_area(
-            "Your Query:",
-            placeholder="e.g., Design a microservices architecture for a social media platform",
-            height=120,
-            value=st.session_state.last_query if st.session_state.last_mode == "🎯 Single Query" else "",
-            key="user_input"
-        )
+        # Form defers reruns until submit, so typing doesn't rebuild the scaffold
+        with st.form("single_query_form"):
+            user_input = st.text_area(
+                "Your Query:",
+                placeholder="e.g., Design a microservices architecture for a social media platform",
+                height=120,
+                value=st.session_state.last_query if st.session_state.last_mode == "🎯 Single Query" else "",
+                key="user_input"
+            )
+            submitted = st.form_submit_button("🔨 Build Scaffold", type="primary")
         # Save query to session state
-        if user_input:
+        if submitted and user_input:
             st.session_state.last_query = user_input
+        if submitted and len(user_input.strip()) <= 10:
+            st.warning("Please enter a query longer than 10 characters.")
 
     with col2:
         provider = st.selectbox("Select Provider:", available_providers, key="provider")
@@ -195,9 +356,25 @@ if mode == "🎯 Single Query":
 
     if user_input and len(user_input.strip()) > 10:
 
+        # First build of this input: stream the reformulation so text appears right away.
+        # The engine caches the finished text, so the scaffold build below reuses it.
+        build_key = (user_input, technique_id)
+        if use_reformulation and build_key not in st.session_state.streamed_reformulations:
+            preview = st.empty()
+            try:
+                with preview.container():
+                    st.caption("🤖 Intelligently reformulating prompt...")
+                    st.write_stream(components['engine'].stream_reformulation(user_input, technique_id=technique_id))
+                # The finished text is cached now, so later reruns skip the preview
+                st.session_state.streamed_reformulations.add(build_key)
+            except Exception as e:
+                # build_scaffold below retries (and falls back) on its own
+                print(f"Warning: Reformulation stream failed ({e})")
+            preview.empty()
+
         # Build scaffold
         with st.spinner("🔨 Building prompt scaffold..." if not use_reformulation else "🤖 Intelligently reformulating prompt..."):
-            scaffold, technique = components['engine'].build_scaffold(
+            scaffold, technique = build_scaffold(
                 user_input,
                 technique_id=technique_id,
                 use_reformulation=use_reformulation
@@ -212,17 +389,11 @@ if mode == "🎯 Single Query":
         with st.expander("📚 Source & Selection Reasoning", expanded=False):
             # Evidence/Citations
             evidence = technique.get('evidence', [])
+            chosen_source = "(none)"
             if evidence:
-                if isinstance(evidence, str):
-                    evidence = [e.strip() for e in evidence.split(',')]
                 st.markdown("**📖 Evidence/Citations:**")
-                for cite in evidence:
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.markdown(f"- `{cite}`")
-                    with col2:
-                        if st.button(f"📄 Read", key=f"read_{cite}"):
-                            st.session_state[f'show_source_{cite}'] = True
+                st.markdown("\n".join(f"- `{cite}`" for cite in evidence))
+                chosen_source = st.selectbox("📄 Read source:", ["(none)"] + evidence, key="read_source")
 
             # Year and citation count
             col1, col2, col3 = st.columns(3)
@@ -234,7 +405,7 @@ if mode == "🎯 Single Query":
                 st.metric("Citations", citation_count if citation_count != 'N/A' else 'Custom')
             with col3:
                 if 'similarity_score' in technique:
-                    match_quality = "Excellent" if technique['similarity_score'] < 0.3 else "Good" if technique['similarity_score'] < 0.5 else "Fair"
+                    match_quality = MATCH_QUALITY_LABELS[bisect.bisect_right(MATCH_QUALITY_THRESHOLDS, technique['similarity_score'])]
                     st.metric("Match Quality", match_quality)
 
             # Selection reasoning
@@ -246,46 +417,39 @@ if mode == "🎯 Single Query":
             # Use cases
             use_cases = technique.get('use_cases', [])
             if use_cases:
-                if isinstance(use_cases, str):
-                    use_cases = [uc.strip() for uc in use_cases.split(',')]
                 st.markdown("**💡 Optimized For:**")
                 st.write(", ".join(use_cases))
 
-        # Display source documents if user clicked "Read"
-        evidence = technique.get('evidence', [])
-        if evidence:
-            if isinstance(evidence, str):
-                evidence = [e.strip() for e in evidence.split(',')]
-
-            for cite in evidence:
-                if st.session_state.get(f'show_source_{cite}', False):
-                    with st.expander(f"📖 Reading: {cite}", expanded=True):
-                        source_content = components['pdf_viewer'].get_source_content(cite)
-
-                        if source_content['found']:
-                            st.markdown(f"### {source_content['title']}")
-                            st.caption(f"**Authors:** {source_content['authors']}")
-
-                            if source_content.get('url'):
-                                st.markdown(f"🔗 [View on arXiv]({source_content['url']})")
-
-                            st.divider()
-
-                            if source_content.get('type') == 'markdown':
-                                st.markdown(source_content['text'])
-                            else:
-                                st.text_area(
-                                    "Source Content (relevant sections):",
-                                    value=source_content['text'],
-                                    height=400,
-                                    key=f"source_text_{cite}"
-                                )
-
-                            if st.button(f"❌ Close", key=f"close_{cite}"):
-                                st.session_state[f'show_source_{cite}'] = False
-                                st.rerun()
-                        else:
-                            st.warning(source_content['message'])
+        # Display the source document the user chose to read
+        if chosen_source != "(none)":
+            with st.expander(f"📖 Reading: {chosen_source}", expanded=True):
+                source_content = cached_source_content(
+                    chosen_source, components['pdf_viewer'].source_mtime(chosen_source)
+                )
+
+                if source_content['found']:
+                    st.markdown(f"### {source_content['title']}")
+                    st.caption(f"**Authors:** {source_content['authors']}")
+
+                    if source_content.get('url'):
+                        st.markdown(f"🔗 [View on arXiv]({source_content['url']})")
+
+                    st.divider()
+
+                    if source_content.get('type') == 'markdown':
+                        st.markdown(source_content['text'])
+                    else:
+                        st.text_area(
+                            "Source Content (relevant sections):",
+                            value=source_content['text'],
+                            height=400,
+                            key=f"source_text_{chosen_source}"
+                        )
+
+                    st.button("❌ Close", key="close_source",
+                              on_click=lambda: st.session_state.update(read_source="(none)"))
+                else:
+                    st.warning(source_content['message'])
 
         # Show reformulation indicator
         if use_reformulation:
@@ -303,30 +467,10 @@ if mode == "🎯 Single Query":
             col1, col2, col3, col4 = st.columns(4)
 
             with col1:
-                if st.button("▶️ Run Query", type="primary", use_container_width=True):
-                    start_time = time.time()
-
-                    with st.spinner(f"🤖 {provider.upper()} is thinking..."):
-                        response, metadata = components['client'].complete(
-                            provider=provider,
-                            system_prompt=edited_scaffold,
-                            user_message=user_input,
-                            temperature=temperature,
-                            max_tokens=max_tokens
-                        )
-
-                        response_time = int((time.time() - start_time) * 1000)
-
-                        st.session_state.responses[provider] = {
-                            'text': response,
-                            'metadata': metadata,
-                            'response_time': response_time
-                        }
+                run_clicked = st.button("▶️ Run Query", type="primary", use_container_width=True)
 
             with col2:
-                if st.button("📋 Copy Scaffold", use_container_width=True):
-                    st.code(edited_scaffold, language="text")
-                    st.success("✅ Ready to copy!")
+                copy_scaffold_button(edited_scaffold)
 
             with col3:
                 if st.button("🔄 Reset", use_container_width=True):
@@ -342,13 +486,45 @@ if mode == "🎯 Single Query":
                     st.success(f"✅ Exported to: {filepath}")
 
         # Response display
-        if provider in st.session_state.responses:
+        if run_clicked:
             st.divider()
             st.subheader(f"🤖 {provider.upper()} Response")
 
-            response_data = st.session_state.responses[provider]
+            start_time = time.perf_counter()
+            metadata = {}
+
+            def text_chunks():
+                # The provider stream ends with a metadata dict
+                for chunk in components['client'].stream(
+                    provider=provider,
+                    system_prompt=edited_scaffold,
+                    user_message=user_input,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ):
+                    if isinstance(chunk, dict):
+                        metadata.update(chunk)
+                    else:
+                        yield chunk
+
+            response = st.write_stream(text_chunks())
+            response_time = int((time.perf_counter() - start_time) * 1000)
+
+            session_responses()[('single', provider)] = {
+                'text': response,
+                'metadata': metadata,
+                'response_time': response_time
+            }
+
+        response_data = session_responses().get(('single', provider))
+
+        if response_data and not run_clicked:
+            st.divider()
+            st.subheader(f"🤖 {provider.upper()} Response")
             st.write(response_data['text'])
 
+        if response_data:
+
             # Metadata
             if show_metadata:
                 with st.expander("📊 Response Metadata"):
@@ -388,13 +564,13 @@ elif mode == "⚖️ Comparison":
     st.subheader("Compare Techniques or Providers")
 
     # Show previous results if available
-    if st.session_state.comparison_results:
+    if 'comparison' in session_responses():
         col_a, col_b = st.columns([3, 1])
         with col_a:
             st.info("📊 Previous comparison results are shown below. Run a new comparison to replace them.")
         with col_b:
             if st.button("🗑️ Clear Results", use_container_width=True):
-                st.session_state.comparison_results = {}
+                session_responses().pop('comparison', None)
                 st.session_state.comparison_type = None
                 st.session_state.comparison_technique = None
                 st.rerun()
@@ -419,12 +595,11 @@ elif mode == "⚖️ Comparison":
         provider = st.selectbox("Provider:", available_providers)
 
         # Technique selection
-        all_techniques = components['engine'].kb
-        technique_options = {t['name']: t['id'] for t in all_techniques}
+        kb_by_name = components['engine'].kb_by_name
 
         selected = st.multiselect(
             "Select techniques to compare (2-4):",
-            options=list(technique_options.keys()),
+            options=list(kb_by_name.keys()),
             max_selections=4
         )
 
@@ -433,23 +608,24 @@ elif mode == "⚖️ Comparison":
 
             progress_bar = st.progress(0)
 
-            for i, tech_name in enumerate(selected):
-                tech_id = technique_options[tech_name]
-
-                with st.spinner(f"Running {tech_name}..."):
-                    scaffold, technique = components['engine'].build_scaffold(
-                        user_input,
-                        technique_id=tech_id
-                    )
+            def run_technique(tech_name):
+                scaffold, technique = build_scaffold(
+                    user_input,
+                    technique_id=kb_by_name[tech_name]['id']
+                )
 
-                    response, metadata = components['client'].complete(
-                        provider=provider,
-                        system_prompt=scaffold,
-                        user_message=user_input,
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
+                response, metadata = components['client'].complete(
+                    provider=provider,
+                    system_prompt=scaffold,
+                    user_message=user_input,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                return response, metadata, technique
 
+            with st.spinner(f"Running {len(selected)} techniques..."):
+                for i, (tech_name, (response, metadata, technique)) in enumerate(
+                        run_concurrently(run_technique, selected)):
                     results[tech_name] = {
                         'response': response,
                         'metadata': metadata,
@@ -458,15 +634,19 @@ elif mode == "⚖️ Comparison":
                         'query': user_input
                     }
 
-                progress_bar.progress((i + 1) / len(selected))
+                    progress_bar.progress((i + 1) / len(selected))
 
-            # Save to session state
-            st.session_state.comparison_results = results
+            # Keep the selection order for display
+            results = {name: results[name] for name in selected}
+
+            # Bodies go to the session response store; session state keeps the run id and type
+            session_responses()['comparison'] = results
+            st.session_state.comparison_run_id = uuid.uuid4().hex[:8]
             st.session_state.comparison_type = "techniques"
 
         # Display results if they exist (outside the button block)
-        if st.session_state.comparison_results and st.session_state.get('comparison_type') == 'techniques':
-            results = st.session_state.comparison_results
+        results = session_responses().get('comparison')
+        if results and st.session_state.get('comparison_type') == 'techniques':
 
             # Display side-by-side
             st.divider()
@@ -490,13 +670,13 @@ elif mode == "⚖️ Comparison":
                 with col:
                     # Get saved query from session state
                     saved_query = data.get('query', user_input)
-                    rating_key = f"rating_comp_{tech_name}_{hash(saved_query)}"
+                    rating_key = f"rating_comp_{tech_name}_{st.session_state.comparison_run_id}"
                     rating = st.slider(
                         f"Rate {tech_name}:",
                         1, 5, 3,
                         key=rating_key
                     )
-                    if st.button(f"💾 Save", key=f"save_{tech_name}_{hash(saved_query)}", use_container_width=True):
+                    if st.button(f"💾 Save", key=f"save_{tech_name}_{st.session_state.comparison_run_id}", use_container_width=True):
                         # Log to analytics
                         components['analytics'].log_interaction(
                             query=saved_query,
@@ -522,13 +702,12 @@ elif mode == "⚖️ Comparison":
         use_custom_technique = st.checkbox("Use specific technique")
 
         if use_custom_technique:
-            all_techniques = components['engine'].kb
-            technique_options = {t['name']: t['id'] for t in all_techniques}
-            selected_tech = st.selectbox("Technique:", list(technique_options.keys()))
-            technique_id = technique_options[selected_tech]
+            kb_by_name = components['engine'].kb_by_name
+            selected_tech = st.selectbox("Technique:", list(kb_by_name.keys()))
+            technique_id = kb_by_name[selected_tech]['id']
 
         if st.button("🔬 Run Comparison", type="primary") and len(selected_providers) >= 2:
-            scaffold, technique = components['engine'].build_scaffold(
+            scaffold, technique = build_scaffold(
                 user_input,
                 technique_id=technique_id
             )
@@ -536,16 +715,18 @@ elif mode == "⚖️ Comparison":
             results = {}
             progress_bar = st.progress(0)
 
-            for i, prov in enumerate(selected_providers):
-                with st.spinner(f"Running with {prov.upper()}..."):
-                    response, metadata = components['client'].complete(
-                        provider=prov,
-                        system_prompt=scaffold,
-                        user_message=user_input,
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
+            def run_provider(prov):
+                return components['client'].complete(
+                    provider=prov,
+                    system_prompt=scaffold,
+                    user_message=user_input,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
 
+            with st.spinner(f"Running with {len(selected_providers)} providers..."):
+                for i, (prov, (response, metadata)) in enumerate(
+                        run_concurrently(run_provider, selected_providers)):
                     results[prov] = {
                         'response': response,
                         'metadata': metadata,
@@ -553,16 +734,20 @@ elif mode == "⚖️ Comparison":
                         'query': user_input
                     }
 
-                progress_bar.progress((i + 1) / len(selected_providers))
+                    progress_bar.progress((i + 1) / len(selected_providers))
+
+            # Keep the selection order for display
+            results = {prov: results[prov] for prov in selected_providers}
 
-            # Save to session state
-            st.session_state.comparison_results = results
+            # Bodies go to the session response store; session state keeps the run id and type
+            session_responses()['comparison'] = results
+            st.session_state.comparison_run_id = uuid.uuid4().hex[:8]
             st.session_state.comparison_type = "providers"
             st.session_state.comparison_technique = technique
 
         # Display results if they exist (outside the button block)
-        if st.session_state.comparison_results and st.session_state.get('comparison_type') == 'providers':
-            results = st.session_state.comparison_results
+        results = session_responses().get('comparison')
+        if results and st.session_state.get('comparison_type') == 'providers':
             technique = st.session_state.get('comparison_technique')
 
             # Display side-by-side
@@ -571,8 +756,6 @@ elif mode == "⚖️ Comparison":
 
             # Radar chart comparison
             if len(results) >= 2:
-                import plotly.graph_objects as go
-
                 st.subheader("📊 Provider Comparison Radar")
 
                 # Create metrics
@@ -636,13 +819,13 @@ elif mode == "⚖️ Comparison":
                 with col:
                     # Get saved query from session state
                     saved_query = data.get('query', user_input)
-                    rating_key = f"rating_prov_{prov}_{hash(saved_query)}"
+                    rating_key = f"rating_prov_{prov}_{st.session_state.comparison_run_id}"
                     rating = st.slider(
                         f"Rate {prov.upper()}:",
                         1, 5, 3,
                         key=rating_key
                     )
-                    if st.button(f"💾 Save", key=f"save_{prov}_{hash(saved_query)}", use_container_width=True):
+                    if st.button(f"💾 Save", key=f"save_{prov}_{st.session_state.comparison_run_id}", use_container_width=True):
                         # Log to analytics
                         saved_technique = data.get('technique', technique)
                         components['analytics'].log_interaction(
@@ -661,27 +844,19 @@ elif mode == "⚖️ Comparison":
 # === MODE: ANALYTICS ===
 elif mode == "📊 Analytics":
     st.subheader("Performance Analytics")
+    analytics = components['analytics']
+    dashboard = cached_dashboard(analytics.db_path, analytics.write_epoch)
 
     tab1, tab2, tab3 = st.tabs(["📈 Techniques", "🤖 Providers", "📜 History"])
 
     with tab1:
         st.markdown("### Technique Performance")
 
-        stats = components['analytics'].get_technique_stats()
+        stats = dashboard['techniques']
 
         if not stats.empty:
-            import plotly.express as px
-
-            fig = px.bar(
-                stats,
-                x='technique_name',
-                y='uses',
-                color='avg_rating',
-                title='Technique Usage & Ratings',
-                labels={'uses': 'Times Used', 'avg_rating': 'Avg Rating'},
-                color_continuous_scale='Viridis'
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            figures = cached_analytics_figures(analytics.db_path, analytics.write_epoch)
+            st.plotly_chart(figures['technique_bar'], use_container_width=True)
 
             st.dataframe(stats, use_container_width=True)
         else:
@@ -698,30 +873,18 @@ elif mode == "📊 Analytics":
     with tab2:
         st.markdown("### Provider Comparison")
 
-        provider_stats = components['analytics'].get_provider_comparison()
+        provider_stats = dashboard['providers']
 
         if not provider_stats.empty:
             col1, col2 = st.columns(2)
 
+            figures = cached_analytics_figures(analytics.db_path, analytics.write_epoch)
+
             with col1:
-                fig = px.pie(
-                    provider_stats,
-                    values='uses',
-                    names='provider',
-                    title='Usage Distribution'
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(figures['provider_pie'], use_container_width=True)
 
             with col2:
-                fig = px.bar(
-                    provider_stats,
-                    x='provider',
-                    y='avg_rating',
-                    title='Average Ratings',
-                    color='avg_rating',
-                    color_continuous_scale='RdYlGn'
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(figures['provider_bar'], use_container_width=True)
 
             st.dataframe(provider_stats, use_container_width=True)
         else:
@@ -730,7 +893,7 @@ elif mode == "📊 Analytics":
     with tab3:
         st.markdown("### Recent History")
 
-        history = components['analytics'].get_recent_history(limit=50)
+        history = dashboard['history']
 
         if not history.empty:
             st.dataframe(history, use_container_width=True)
@@ -739,18 +902,12 @@ elif mode == "📊 Analytics":
 
             # Debug: Show database info
             with st.expander("🔍 Debug Analytics"):
-                import os
                 db_path = components['analytics'].db_path
                 st.caption(f"Database path: {db_path}")
                 st.caption(f"Database exists: {os.path.exists(db_path)}")
 
-                if os.path.exists(db_path):
-                    import sqlite3
-                    conn = sqlite3.connect(db_path)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT COUNT(*) FROM interactions")
-                    count = cursor.fetchone()[0]
-                    conn.close()
+                if os.path.exists(db_path) and st.checkbox("Show DB debug"):
+                    count = cached_interaction_count(db_path)
                     st.caption(f"Total interactions in DB: {count}")
                     st.caption("If count is 0, you need to run queries and click 'Save Rating'")
 
@@ -772,23 +929,13 @@ elif mode == "📤 Export":
     if export_type == "📦 All Techniques":
         if st.button("📤 Export All Techniques", type="primary"):
             with st.spinner("Exporting..."):
-                exported = []
-                for tech in components['engine'].kb:
-                    scaffold, _ = components['engine'].build_scaffold(
-                        "Example query",
-                        technique_id=tech['id']
-                    )
-                    filepath = components['exporter'].export_scaffold(tech, scaffold)
-                    exported.append(filepath)
-
-                components['exporter'].create_readme(exported)
+                exported = export_techniques(components['engine'].kb)
 
             st.success(f"✅ Exported {len(exported)} techniques to ./exports/")
             st.info("Copy these files to `.claude/commands/` in your project")
 
     elif export_type == "🎯 Specific Techniques":
-        all_techniques = components['engine'].kb
-        technique_options = {f"{t['name']} ({t['category']})": t for t in all_techniques}
+        technique_options = technique_options_labeled()
 
         selected = st.multiselect(
             "Select techniques to export:",
@@ -797,17 +944,7 @@ elif mode == "📤 Export":
 
         if st.button("📤 Export Selected", type="primary") and selected:
             with st.spinner("Exporting..."):
-                exported = []
-                for tech_key in selected:
-                    tech = technique_options[tech_key]
-                    scaffold, _ = components['engine'].build_scaffold(
-                        "Example query",
-                        technique_id=tech['id']
-                    )
-                    filepath = components['exporter'].export_scaffold(tech, scaffold)
-                    exported.append(filepath)
-
-                components['exporter'].create_readme(exported)
+                exported = export_techniques([technique_options[key] for key in selected])
 
             st.success(f"✅ Exported {len(exported)} techniques!")
 
@@ -869,8 +1006,7 @@ elif mode == "📋 ChatGPT Instructions":
     # Load the instructions file
     instructions_path = Path("chatgpt_project_instructions.md")
     if instructions_path.exists():
-        with open(instructions_path, 'r', encoding='utf-8') as f:
-            instructions_content = f.read()
+        instructions_content = cached_text_file(str(instructions_path), instructions_path.stat().st_mtime)
 
         st.text_area(
             "📋 Copy these instructions:",
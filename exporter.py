@@ -1,13 +1,40 @@
 # exporter.py
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+# Spaces and hyphens both become underscores in command filenames
+FILENAME_TABLE = str.maketrans({' ': '_', '-': '_'})
+
+README_HEADER = """# Exported Claude Code Commands
+
+## Installation
+
+Copy these `.md` files to your Claude Code commands directory:
+
+```bash
+# For project-specific commands
+cp *.md /path/to/your/project/.claude/commands/
+
+# For global commands
+cp *.md ~/.claude/commands/
+```
+
+## Available Commands
+
+"""
 
 class ClaudeCodeExporter:
     """Export scaffolds as Claude Code commands"""
 
+    # Output directories already created by this process
+    _ensured_dirs = set()
+
     def __init__(self, output_dir: str = "./exports"):
         self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(exist_ok=True)
+        if self.output_dir not in self._ensured_dirs:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._ensured_dirs.add(self.output_dir)
 
     def export_scaffold(self, technique: Dict, scaffold: str,
                        custom_name: str = None) -> str:
@@ -15,70 +42,78 @@ class ClaudeCodeExporter:
         Export scaffold as .md command file
         Returns: filepath
         """
+        filepath, content = self._build_command(technique, scaffold, custom_name)
+        self._write(filepath, content)
+        return str(filepath)
+
+    def _build_command(self, technique: Dict, scaffold: str,
+                       custom_name: str = None) -> Tuple[Path, str]:
+        """Format a command file without touching disk. Returns: (filepath, content)"""
         # Generate filename
         name = custom_name or technique['name']
-        filename = name.lower().replace(' ', '_').replace('-', '_') + ".md"
+        filename = name.lower().translate(FILENAME_TABLE) + ".md"
         filepath = self.output_dir / filename
 
+        category = technique.get('category', 'General')
+
         # Build frontmatter
-        frontmatter = f"""---
-description: {technique['name']} - {technique.get('category', 'General')}
-category: {technique.get('category', 'General')}
-argument-hint: <YOUR_QUERY>
-"""
+        parts = [
+            "---\n",
+            f"description: {technique['name']} - {category}\n",
+            f"category: {category}\n",
+            "argument-hint: <YOUR_QUERY>\n",
+        ]
 
         # Add evidence if available
         if 'evidence' in technique:
-            frontmatter += f"evidence: [{', '.join(technique['evidence'])}]\n"
-
-        frontmatter += "---\n\n"
+            parts.append(f"evidence: [{', '.join(technique['evidence'])}]\n")
 
         # Build command content
-        content = frontmatter
-        content += f"# {technique['name']}\n\n"
-        content += f"**Category**: {technique.get('category', 'General')}  \n"
-        content += f"**Use Cases**: {', '.join(technique.get('use_cases', ['general']))}  \n\n"
-        content += "## Instructions\n\n"
-        content += scaffold
-        content += "\n\n## Usage\n\n"
-        content += f"```bash\n/{filename.replace('.md', '')} <YOUR_QUERY>\n```\n"
-
-        # Write file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+        parts += [
+            "---\n\n",
+            f"# {technique['name']}\n\n",
+            f"**Category**: {category}  \n",
+            f"**Use Cases**: {', '.join(technique.get('use_cases', ['general']))}  \n\n",
+            "## Instructions\n\n",
+            scaffold,
+            "\n\n## Usage\n\n",
+            f"```bash\n/{filename.replace('.md', '')} <YOUR_QUERY>\n```\n",
+        ]
+        content = "".join(parts)
 
-        return str(filepath)
+        return filepath, content
+
+    @staticmethod
+    def _write(filepath: Path, content: str):
+        filepath.write_text(content, encoding='utf-8')
 
     def export_batch(self, scaffolds: List[Dict]) -> List[str]:
-        """Export multiple scaffolds"""
-        filepaths = []
-        for item in scaffolds:
-            filepath = self.export_scaffold(
+        """Export multiple scaffolds (written concurrently, returned in input order)"""
+        if not scaffolds:
+            return []
+
+        # Format everything up front so the pool only does file writes
+        commands = [
+            self._build_command(
                 technique=item['technique'],
                 scaffold=item['scaffold'],
                 custom_name=item.get('name')
             )
-            filepaths.append(filepath)
-        return filepaths
+            for item in scaffolds
+        ]
+
+        with ThreadPoolExecutor(max_workers=min(32, len(commands))) as executor:
+            list(executor.map(lambda command: self._write(*command), commands))
+
+        return [str(filepath) for filepath, _ in commands]
 
     def create_readme(self, exported_files: List[str]):
         """Create README for exported commands"""
         readme_path = self.output_dir / "README.md"
 
-        content = "# Exported Claude Code Commands\n\n"
-        content += "## Installation\n\n"
-        content += "Copy these `.md` files to your Claude Code commands directory:\n\n"
-        content += "```bash\n"
-        content += "# For project-specific commands\n"
-        content += "cp *.md /path/to/your/project/.claude/commands/\n\n"
-        content += "# For global commands\n"
-        content += "cp *.md ~/.claude/commands/\n"
-        content += "```\n\n"
-        content += "## Available Commands\n\n"
-
+        parts = [README_HEADER]
         for filepath in exported_files:
             filename = Path(filepath).stem
-            content += f"- `/{filename}` - {filepath}\n"
+            parts.append(f"- `/{filename}` - {filepath}\n")
 
-        with open(readme_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        self._write(readme_path, "".join(parts))
@@ -1,10 +1,22 @@
 # kb_builder.py
+import os
+import pickle
+import sys
 import yaml
 import fitz  # PyMuPDF
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict
 import re
 
+# {var} placeholders in technique templates
+_VAR_RE = re.compile(r"\{(\w+)\}")
+
+# libyaml C loader/dumper when available
+try:
+    from yaml import CSafeLoader as KBLoader, CSafeDumper as KBDumper
+except ImportError:
+    from yaml import SafeLoader as KBLoader, SafeDumper as KBDumper
+
 def extract_claude_code_patterns() -> List[Dict]:
     """Extract patterns from Claude Code documentation"""
     return [
@@ -314,6 +326,71 @@ Goal: {analysis_goal}
         }
     ]
 
+def compile_template(template: str, variables: List[str]) -> Callable[[Dict], str]:
+    """
+    Split a template once into literal text and {var} slots
+    Returns: render(values) that fills slots in one join, using "[var]" for missing values
+    """
+    if not variables:
+        return lambda values: template
+
+    # Even indices are literal text, odd indices are declared variable names;
+    # undeclared {placeholders} are kept as literal text
+    declared = set(variables)
+    pieces = [""]
+    for i, piece in enumerate(_VAR_RE.split(template)):
+        if i % 2 == 0:
+            pieces[-1] += piece
+        elif piece in declared:
+            pieces += [piece, ""]
+        else:
+            pieces[-1] += "{" + piece + "}"
+
+    def render(values: Dict) -> str:
+        out = pieces[:]
+        for i in range(1, len(out), 2):
+            out[i] = values.get(out[i], f"[{out[i]}]")
+        return "".join(out)
+
+    return render
+
+def _write_pickle(techniques: List[Dict], pkl_path: Path):
+    """Write the pickle sidecar atomically; a read-only deploy just skips it"""
+    tmp_path = pkl_path.with_suffix(".pkl.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(techniques, f, protocol=5)
+        os.replace(tmp_path, pkl_path)
+    except OSError:
+        pass
+
+def _intern_shared_strings(techniques: List[Dict]) -> List[Dict]:
+    """Intern categories and evidence ids, which repeat across many techniques"""
+    for t in techniques:
+        if isinstance(t.get("category"), str):
+            t["category"] = sys.intern(t["category"])
+        if isinstance(t.get("evidence"), list):
+            t["evidence"] = [sys.intern(e) for e in t["evidence"]]
+    return techniques
+
+def load_knowledge_base(path: str = "prompt_kb.yaml") -> List[Dict]:
+    """Load the KB from its pickle sidecar if it is at least as new as the YAML"""
+    yaml_path = Path(path)
+    pkl_path = yaml_path.with_suffix(".pkl")
+
+    try:
+        if pkl_path.stat().st_mtime >= yaml_path.stat().st_mtime:
+            with open(pkl_path, "rb") as f:
+                return _intern_shared_strings(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    # Sidecar missing or stale: parse the YAML and regenerate it
+    with open(yaml_path) as f:
+        techniques = yaml.load(f, Loader=KBLoader)
+    _write_pickle(techniques, pkl_path)
+    return _intern_shared_strings(techniques)
+
 def build_knowledge_base():
     """Build comprehensive KB from all sources"""
     techniques = []
@@ -323,9 +400,18 @@ def build_knowledge_base():
     techniques.extend(extract_claude_code_patterns())
     techniques.extend(extract_domain_templates())
 
-    # Write to YAML
+    # Record each template's placeholders once and flag drift from the declared list
+    for t in techniques:
+        found = list(dict.fromkeys(_VAR_RE.findall(t["template"])))
+        if "variables" not in t:
+            t["variables"] = found
+        elif set(found) != set(t["variables"]):
+            print(f"[WARN] {t['id']}: template uses {found}, declares {t['variables']}")
+
+    # Write to YAML, plus a pickle sidecar for fast loading
     with open("prompt_kb.yaml", "w") as f:
-        yaml.dump(techniques, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+        yaml.dump(techniques, f, Dumper=KBDumper, default_flow_style=False, sort_keys=False, allow_unicode=True)
+    _write_pickle(techniques, Path("prompt_kb.pkl"))
 
     # Print summary
     categories = {}
@@ -1,8 +1,40 @@
 # pdf_viewer.py
 import fitz  # PyMuPDF
+import functools
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 
+# Single-pass multi-keyword search (in requirements.txt; the str.find loop covers installs without it)
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+
+@functools.lru_cache(maxsize=32)
+def _load_pages(path: str, mtime: float) -> Tuple[str, ...]:
+    """Extract the text of every page once; mtime in the key invalidates edits"""
+    with fitz.open(path) as doc:
+        return tuple(page.get_text() for page in doc)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_pages_lower(path: str, mtime: float) -> Tuple[str, ...]:
+    """Lower-cased page text for case-insensitive keyword search"""
+    return tuple(text.lower() for text in _load_pages(path, mtime))
+
+
+@functools.lru_cache(maxsize=64)
+def _build_automaton(keywords: Tuple[str, ...]):
+    """Aho-Corasick automaton over lower-cased keywords, built once per keyword set"""
+    automaton = ahocorasick.Automaton()
+    # Each word keeps the index of its first occurrence so matches can honour keyword order
+    for index, keyword in reversed(list(enumerate(keywords))):
+        automaton.add_word(keyword, (index, keyword))
+    automaton.make_automaton()
+    return automaton
+
 class PDFSourceViewer:
     """Extract and display relevant sections from research papers"""
 
@@ -71,6 +103,14 @@ class PDFSourceViewer:
         """Get source information for an evidence ID"""
         return self.source_map.get(evidence_id)
 
+    def source_mtime(self, evidence_id: str) -> Optional[float]:
+        """Modification time of an evidence ID's source file, or None if it is missing"""
+        source_info = self.get_source_info(evidence_id)
+        if not source_info:
+            return None
+        source_path = self.pdf_dir / source_info["file"]
+        return source_path.stat().st_mtime if source_path.exists() else None
+
     def extract_pdf_text(self, filename: str, max_pages: int = 20) -> str:
         """Extract text from PDF file"""
         pdf_path = self.pdf_dir / filename
@@ -79,49 +119,66 @@ class PDFSourceViewer:
             return f"PDF file not found: {filename}"
 
         try:
-            doc = fitz.open(pdf_path)
+            pages = _load_pages(str(pdf_path), pdf_path.stat().st_mtime)
             text = ""
 
             # Extract from first max_pages
-            for page_num in range(min(len(doc), max_pages)):
-                page = doc[page_num]
+            for page_num, page_text in enumerate(pages[:max_pages]):
                 text += f"\n\n--- Page {page_num + 1} ---\n\n"
-                text += page.get_text()
+                text += page_text
 
-            doc.close()
             return text
         except Exception as e:
             return f"Error extracting PDF: {str(e)}"
 
     def search_pdf_for_keywords(self, filename: str, keywords: List[str],
-                                context_chars: int = 500) -> List[Tuple[int, str]]:
-        """Search PDF for keywords and return relevant sections with context"""
+                                context_chars: int = 500,
+                                max_results: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Search PDF for keywords and return relevant sections with context, stopping after max_results"""
         pdf_path = self.pdf_dir / filename
 
         if not pdf_path.exists():
             return []
 
         try:
-            doc = fitz.open(pdf_path)
+            mtime = pdf_path.stat().st_mtime
+            pages = _load_pages(str(pdf_path), mtime)
+            pages_lower = _load_pages_lower(str(pdf_path), mtime)
+            keywords_lower = [keyword.lower() for keyword in keywords]
+            automaton = _build_automaton(tuple(keywords_lower)) if HAS_AHOCORASICK and keywords_lower else None
             results = []
 
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text = page.get_text()
-
-                # Search for each keyword
-                for keyword in keywords:
-                    if keyword.lower() in text.lower():
-                        # Find position and extract context
-                        pos = text.lower().find(keyword.lower())
-                        start = max(0, pos - context_chars)
-                        end = min(len(text), pos + len(keyword) + context_chars)
-
-                        context = text[start:end]
-                        results.append((page_num + 1, context))
-                        break  # Found keyword on this page, move to next page
+            for page_num, (text, text_lower) in enumerate(zip(pages, pages_lower)):
+                if automaton is not None:
+                    # One pass over the page for all keywords. Like the fallback, the
+                    # first keyword in the list wins, at its earliest position.
+                    best = None
+                    for end_index, (index, keyword) in automaton.iter(text_lower):
+                        if best is None or index < best[0]:
+                            best = (index, keyword, end_index - len(keyword) + 1)
+                            if index == 0:
+                                break
+                    if best is None:
+                        continue
+                    _, keyword, pos = best
+                else:
+                    # Search for each keyword
+                    for keyword in keywords_lower:
+                        pos = text_lower.find(keyword)
+                        if pos != -1:
+                            break
+                    else:
+                        continue
+
+                # Extract context around the match; one section per page
+                start = max(0, pos - context_chars)
+                end = min(len(text), pos + len(keyword) + context_chars)
+
+                context = text[start:end]
+                results.append((page_num + 1, context))
+                if max_results is not None and len(results) >= max_results:
+                    break
 
-            doc.close()
             return results
         except Exception as e:
             return []
@@ -161,12 +218,13 @@ class PDFSourceViewer:
                 sections = self.search_pdf_for_keywords(
                     source_info["file"],
                     source_info["keywords"],
-                    context_chars=800
+                    context_chars=800,
+                    max_results=5
                 )
 
                 if sections:
                     text = f"Found {len(sections)} relevant section(s):\n\n"
-                    for page_num, context in sections[:5]:  # Limit to 5 sections
+                    for page_num, context in sections:
                         text += f"\n{'='*60}\n"
                         text += f"Page {page_num}\n"
                         text += f"{'='*60}\n\n"
@@ -1,9 +1,10 @@
 # providers.py
+import functools
 import os
 from openai import OpenAI
 from anthropic import Anthropic
 from dotenv import load_dotenv
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple, Union
 
 # Load environment variables from .env file (local development)
 load_dotenv()
@@ -19,8 +20,9 @@ try:
 except:
     USE_STREAMLIT_SECRETS = False
 
+@functools.lru_cache(maxsize=64)
 def get_env(key: str, default: str = None) -> str:
-    """Get environment variable from either .env or Streamlit secrets"""
+    """Get environment variable from either .env or Streamlit secrets (memoised; see get_env.cache_clear)"""
     if USE_STREAMLIT_SECRETS:
         try:
             # Streamlit secrets accessed with bracket notation or .get() on the underlying dict
@@ -44,7 +46,7 @@ class MultiProviderClient:
         anthropic_key = get_env("ANTHROPIC_API_KEY")
         if anthropic_key:
             self.providers["claude"] = {
-                "client": Anthropic(api_key=anthropic_key),
+                "api_key": anthropic_key,
                 "model": get_env("CLAUDE_MODEL", "claude-sonnet-4-5-20250929"),
                 "type": "anthropic"
             }
@@ -53,7 +55,7 @@ class MultiProviderClient:
         openai_key = get_env("OPENAI_API_KEY")
         if openai_key:
             self.providers["gpt"] = {
-                "client": OpenAI(api_key=openai_key),
+                "api_key": openai_key,
                 "model": get_env("GPT_MODEL", "gpt-4o-mini"),
                 "type": "openai"
             }
@@ -62,14 +64,32 @@ class MultiProviderClient:
         grok_key = get_env("XAI_API_KEY")
         if grok_key:
             self.providers["grok"] = {
-                "client": OpenAI(
-                    api_key=grok_key,
-                    base_url=get_env("XAI_BASE_URL", "https://api.x.ai/v1")
-                ),
+                "api_key": grok_key,
+                "base_url": get_env("XAI_BASE_URL", "https://api.x.ai/v1"),
                 "model": get_env("XAI_MODEL", "grok-4-fast-reasoning"),
                 "type": "openai"
             }
 
+        # Bind each provider's request functions once instead of branching per call
+        handlers = {
+            "anthropic": (self._complete_anthropic, self._stream_anthropic),
+            "openai": (self._complete_openai, self._stream_openai),
+        }
+        for config in self.providers.values():
+            config["complete"], config["stream"] = handlers[config["type"]]
+
+    def _client(self, config: Dict):
+        """Build the SDK client on first use and keep it on the provider config"""
+        client = config.get("client")
+        if client is None:
+            # A concurrent first call may build a second client; last one wins, both work
+            if config["type"] == "anthropic":
+                client = Anthropic(api_key=config["api_key"])
+            else:
+                client = OpenAI(api_key=config["api_key"], base_url=config.get("base_url"))
+            config["client"] = client
+        return client
+
     def complete(self, provider: str, system_prompt: str, user_message: str,
                  temperature: float = 0.7, max_tokens: int = 2048) -> Tuple[str, Dict]:
         """
@@ -82,47 +102,114 @@ class MultiProviderClient:
         config = self.providers[provider]
 
         try:
-            if config["type"] == "anthropic":
-                response = config["client"].messages.create(
-                    model=config["model"],
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    system=system_prompt,
-                    messages=[{"role": "user", "content": user_message}]
-                )
-                text = response.content[0].text
-                metadata = {
-                    "provider": provider,
-                    "model": config["model"],
-                    "tokens": response.usage.input_tokens + response.usage.output_tokens,
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-
-            else:  # OpenAI-compatible (GPT, Grok)
-                response = config["client"].chat.completions.create(
-                    model=config["model"],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ]
-                )
-                text = response.choices[0].message.content
-                metadata = {
-                    "provider": provider,
-                    "model": config["model"],
-                    "tokens": response.usage.total_tokens,
-                    "input_tokens": response.usage.prompt_tokens,
-                    "output_tokens": response.usage.completion_tokens
-                }
-
-            return text, metadata
+            text, metadata = config["complete"](config, system_prompt, user_message, temperature, max_tokens)
+            return text, {"provider": provider, **metadata}
 
         except Exception as e:
             return f"Error from {provider}: {str(e)}", {"error": True}
 
+    def stream(self, provider: str, system_prompt: str, user_message: str,
+               temperature: float = 0.7, max_tokens: int = 2048) -> Iterator[Union[str, Dict]]:
+        """
+        Stream completion from specified provider
+        Yields: text chunks, then a final metadata dict
+        """
+        if provider not in self.providers:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        config = self.providers[provider]
+
+        try:
+            for item in config["stream"](config, system_prompt, user_message, temperature, max_tokens):
+                yield {"provider": provider, **item} if isinstance(item, dict) else item
+
+        except Exception as e:
+            yield f"Error from {provider}: {str(e)}"
+            yield {"error": True}
+
+    def _complete_anthropic(self, config: Dict, system_prompt: str, user_message: str,
+                            temperature: float, max_tokens: int) -> Tuple[str, Dict]:
+        response = self._client(config).messages.create(
+            model=config["model"],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system_prompt,
+            messages=[{"role": "user", "content": user_message}]
+        )
+        text = response.content[0].text
+        return text, {
+            "model": config["model"],
+            "tokens": response.usage.input_tokens + response.usage.output_tokens,
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens
+        }
+
+    def _complete_openai(self, config: Dict, system_prompt: str, user_message: str,
+                         temperature: float, max_tokens: int) -> Tuple[str, Dict]:
+        """OpenAI-compatible (GPT, Grok)"""
+        response = self._client(config).chat.completions.create(
+            model=config["model"],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
+        )
+        text = response.choices[0].message.content
+        return text, {
+            "model": config["model"],
+            "tokens": response.usage.total_tokens,
+            "input_tokens": response.usage.prompt_tokens,
+            "output_tokens": response.usage.completion_tokens
+        }
+
+    def _stream_anthropic(self, config: Dict, system_prompt: str, user_message: str,
+                          temperature: float, max_tokens: int) -> Iterator[Union[str, Dict]]:
+        with self._client(config).messages.stream(
+            model=config["model"],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system_prompt,
+            messages=[{"role": "user", "content": user_message}]
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            usage = stream.get_final_message().usage
+        yield {
+            "model": config["model"],
+            "tokens": usage.input_tokens + usage.output_tokens,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens
+        }
+
+    def _stream_openai(self, config: Dict, system_prompt: str, user_message: str,
+                       temperature: float, max_tokens: int) -> Iterator[Union[str, Dict]]:
+        """OpenAI-compatible (GPT, Grok)"""
+        response = self._client(config).chat.completions.create(
+            model=config["model"],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        usage = None
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                usage = chunk.usage
+        yield {
+            "model": config["model"],
+            "tokens": usage.total_tokens if usage else 0,
+            "input_tokens": usage.prompt_tokens if usage else 0,
+            "output_tokens": usage.completion_tokens if usage else 0
+        }
+
     def get_available_providers(self) -> List[str]:
         """Return list of providers with valid API keys"""
         # Simply return the keys from initialized providers
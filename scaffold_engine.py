@@ -1,111 +1,44 @@
 # scaffold_engine.py
-import yaml
-from typing import Dict, List, Tuple
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import ChainMap, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from kb_builder import compile_template, load_knowledge_base
+from typing import Dict, Iterator, List, Optional, Tuple
 from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-import os
 from pathlib import Path
 
-# Support for Streamlit secrets (import from providers.py)
-try:
-    import streamlit as st
-    USE_STREAMLIT_SECRETS = hasattr(st, 'secrets')
-except:
-    USE_STREAMLIT_SECRETS = False
+# Streamlit secrets / .env lookup shared with the provider clients
+from providers import get_env
 
-def get_env(key: str, default: str = None) -> str:
-    """Get environment variable from either .env or Streamlit secrets"""
-    if USE_STREAMLIT_SECRETS:
-        try:
-            # Streamlit secrets accessed with bracket notation or .get() on the underlying dict
-            if key in st.secrets:
-                return st.secrets[key]
-            else:
-                return default
-        except Exception as e:
-            # Fallback if secrets access fails
-            pass
-    return os.getenv(key, default)
-
-class ScaffoldEngine:
-    """Build and manage prompt scaffolds"""
-
-    def __init__(self, kb_path: str = "prompt_kb.yaml"):
-        self.kb = self._load_kb(kb_path)
-        self.vectorstore = self._build_vectorstore()
-        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)  # For prompt reformulation
-
-    def _load_kb(self, path: str) -> List[Dict]:
-        """Load knowledge base"""
-        with open(path) as f:
-            return yaml.safe_load(f)
-
-    def _build_vectorstore(self) -> Chroma:
-        """Create vector store for semantic search"""
-        docs = []
-        for tech in self.kb:
-            content = f"{tech['name']}: {tech.get('template', '')} Use cases: {', '.join(tech.get('use_cases', []))}"
-
-            # Convert metadata to ChromaDB-compatible format (no lists)
-            metadata = {}
-            for k, v in tech.items():
-                if k == 'template':
-                    continue  # Skip template (too large)
-                elif isinstance(v, list):
-                    metadata[k] = ', '.join(str(item) for item in v)  # Convert lists to strings
-                else:
-                    metadata[k] = v
-
-            docs.append(
-                Document(
-                    page_content=content,
-                    metadata=metadata
-                )
-            )
-
-        embeddings = OpenAIEmbeddings(model=get_env("EMBEDDING_MODEL", "text-embedding-3-large"))
-        return Chroma.from_documents(docs, embeddings)
+# Reformulations kept in memory when the on-disk cache can't be used
+REFORMULATION_MEMORY_SIZE = 128
 
-    def find_technique(self, query: str, top_k: int = 3) -> List[Dict]:
-        """Find best techniques for query using semantic search with similarity scores"""
-        results = self.vectorstore.similarity_search_with_score(query, k=top_k)
-        techniques = []
+# KB fields left out of Chroma metadata
+METADATA_SKIP_KEYS = frozenset({'template'})  # too large
 
-        for result, score in results:
-            # Find full technique from KB
-            tech_id = result.metadata.get('id')
-            full_tech = next((t for t in self.kb if t['id'] == tech_id), None)
-            if full_tech:
-                # Add similarity score and ranking info
-                tech_with_score = full_tech.copy()
-                tech_with_score['similarity_score'] = score
-                tech_with_score['match_distance'] = score  # Lower is better
-                techniques.append(tech_with_score)
-
-        return techniques
-
-    def _reformulate_prompt(self, query: str, technique: Dict) -> str:
-        """
-        Intelligently reformulate the user query according to the technique's best practices
-        """
-        reformulation_prompt = f"""You are a prompt engineering expert. Your task is to reformulate a user's query to optimally leverage the "{technique['name']}" technique.
+# Instruction sent to the reformulation LLM; filled per (query, technique)
+REFORMULATION_PROMPT = """You are a prompt engineering expert. Your task is to reformulate a user's query to optimally leverage the "{name}" technique.
 
 TECHNIQUE DETAILS:
-- Name: {technique['name']}
-- Category: {technique['category']}
-- Evidence: {', '.join(technique.get('evidence', ['Unknown']))}
-- Optimized for: {', '.join(technique.get('use_cases', []))}
-- Year: {technique.get('year', 'N/A')}
+- Name: {name}
+- Category: {category}
+- Evidence: {evidence}
+- Optimized for: {use_cases}
+- Year: {year}
 
 ORIGINAL USER QUERY:
 {query}
 
 TECHNIQUE TEMPLATE:
-{technique['template']}
+{template}
 
 TASK:
-Reformulate the user's query to follow the structure and best practices of the {technique['name']} technique. DO NOT just fill in placeholders - actually restructure and enhance the query based on the technique's principles from the research papers.
+Reformulate the user's query to follow the structure and best practices of the {name} technique. DO NOT just fill in placeholders - actually restructure and enhance the query based on the technique's principles from the research papers.
 
 Guidelines:
 1. Analyze what the user is asking
@@ -119,37 +52,283 @@ Guidelines:
 
 REFORMULATED PROMPT (output only the reformulated prompt, no explanations):"""
 
+def _collection_name(kb_hash: str) -> str:
+    """Chroma collection holding the KB version with this hash"""
+    return f"kb_{kb_hash[:32]}"
+
+class ReformulationFailed(Exception):
+    """The reformulation LLM call failed; carries the fallback (scaffold, technique) so callers can use it uncached"""
+
+    def __init__(self, scaffold: str, technique: Dict):
+        super().__init__("Prompt reformulation failed")
+        self.scaffold = scaffold
+        self.technique = technique
+
+class ScaffoldEngine:
+    """Build and manage prompt scaffolds"""
+
+    def __init__(self, kb_path: str = "prompt_kb.yaml", persist_dir: str = ".chroma_kb",
+                 reformulation_cache: str = ".llm_cache.db", prefetch_vectorstore: bool = True):
+        self.persist_dir = Path(persist_dir)
+        self._reform_lock = threading.Lock()
+        self._reform_db = self._open_reformulation_cache(reformulation_cache)
+        self._reform_memory = OrderedDict()
+        self.kb = self._load_kb(kb_path)
+        # The KB is immutable after load, so index it once
+        self.kb_by_id = {t['id']: t for t in self.kb}
+        self.kb_by_name = {t['name']: t for t in self.kb}
+        self.kb_by_category = {}
+        for t in self.kb:
+            self.kb_by_category.setdefault(t.get('category', 'Unknown').split('/')[0], []).append(t)
+        self.categories = sorted(self.kb_by_category)
+        # Renderers stay off the technique dicts, which get pickled and sent to Chroma
+        self.renderers = {t['id']: compile_template(t.get('template', ''), t.get('variables', [])) for t in self.kb}
+        self.system_prompt_parts = {t['id']: self._build_system_prompt_parts(t) for t in self.kb}
+        # The vector store builds on a background thread (or on first search without prefetch),
+        # so construction returns before the embedding calls finish; the LLM is built on first use
+        self._vectorstore_future = None
+        self._vectorstore_lock = threading.Lock()
+        if prefetch_vectorstore:
+            self._start_vectorstore_build()
+        # Repeated queries skip the embedding API call and the vector search
+        self._search = functools.lru_cache(maxsize=512)(self._search_uncached)
+
+    def _start_vectorstore_build(self):
+        # Locked so the persist dir is only ever rebuilt by one thread
+        with self._vectorstore_lock:
+            if self._vectorstore_future is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vectorstore")
+                self._vectorstore_future = executor.submit(self._build_vectorstore)
+                executor.shutdown(wait=False)
+            return self._vectorstore_future
+
+    @property
+    def vectorstore(self) -> Chroma:
+        future = self._vectorstore_future or self._start_vectorstore_build()
         try:
-            response = self.llm.invoke(reformulation_prompt)
-            reformulated = response.content.strip()
-            return reformulated
-        except Exception as e:
-            # Fallback to basic substitution if LLM fails
-            print(f"Warning: Reformulation failed ({e}), using basic substitution")
-            return query
+            return future.result()
+        except Exception:
+            # Forget the failed build so the next search retries it
+            with self._vectorstore_lock:
+                if self._vectorstore_future is future:
+                    self._vectorstore_future = None
+            raise
+
+    @functools.cached_property
+    def llm(self) -> ChatOpenAI:
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0.3)  # For prompt reformulation
 
-    def build_scaffold(self, query: str, technique_id: str = None,
-                      custom_vars: Dict = None, use_reformulation: bool = True) -> Tuple[str, Dict]:
+    def _load_kb(self, path: str) -> List[Dict]:
+        """Load knowledge base, normalizing comma-separated list fields to lists"""
+        kb = load_knowledge_base(path)
+
+        for tech in kb:
+            for key in ('evidence', 'use_cases'):
+                if isinstance(tech.get(key), str):
+                    tech[key] = [item.strip() for item in tech[key].split(',')]
+        return kb
+
+    def _build_vectorstore(self) -> Chroma:
+        """Create vector store for semantic search"""
+        texts, metadatas = [], []
+        for tech in self.kb:
+            # Convert metadata to ChromaDB-compatible format (no lists, no template).
+            # An exact type check covers any list field, and leaves a string-valued
+            # 'variables' alone instead of joining its characters.
+            metadata = {
+                k: ', '.join(map(str, v)) if type(v) is list else v
+                for k, v in tech.items() if k not in METADATA_SKIP_KEYS
+            }
+            texts.append(f"{tech['name']}: {tech.get('template', '')} Use cases: {metadata.get('use_cases', '')}")
+            metadatas.append(metadata)
+
+        embedding_model = get_env("EMBEDDING_MODEL", "text-embedding-3-large")
+        embeddings = OpenAIEmbeddings(model=embedding_model)
+
+        # Reuse the persisted index when neither the documents nor the model changed
+        kb_hash = hashlib.sha256(json.dumps(
+            [embedding_model] + [list(pair) for pair in zip(texts, metadatas)], sort_keys=True, default=str
+        ).encode()).hexdigest()
+        marker = self.persist_dir / "kb_hash"
+        persist_dir = str(self.persist_dir)
+        try:
+            previous_hash = marker.read_text() if marker.exists() else None
+            if previous_hash == kb_hash:
+                return Chroma(collection_name=_collection_name(kb_hash), persist_directory=persist_dir,
+                              embedding_function=embeddings)
+
+            # Each KB version gets its own collection, so a store still open elsewhere in the
+            # process never has its files deleted underneath it. Stale collections (and any
+            # partial one left by a failed build) are dropped through the client instead.
+            for stale_hash in {previous_hash, kb_hash} - {None}:
+                Chroma(collection_name=_collection_name(stale_hash), persist_directory=persist_dir,
+                       embedding_function=embeddings).delete_collection()
+            vectorstore = Chroma(collection_name=_collection_name(kb_hash), persist_directory=persist_dir,
+                                 embedding_function=embeddings)
+            persisted = True
+        except (OSError, sqlite3.Error) as e:
+            # Read-only or broken persist dir: fall back to an in-memory index
+            print(f"Warning: Could not persist vector store ({e}), building in memory")
+            vectorstore = Chroma(embedding_function=embeddings)
+            persisted = False
+
+        # The only embedding call, so an API failure propagates without a paid retry
+        vectorstore.add_texts(texts, metadatas=metadatas)
+        if persisted:
+            try:
+                marker.write_text(kb_hash)
+            except OSError as e:
+                # The index is still usable; it is just rebuilt on the next start
+                print(f"Warning: Could not write vector store marker ({e})")
+        return vectorstore
+
+    def find_technique(self, query: str, top_k: int = 3) -> List[Dict]:
+        """Find best techniques for query using semantic search with similarity scores"""
+        techniques = []
+
+        for tech_id, score in self._search(" ".join(query.split()), top_k):
+            # Find full technique from KB
+            full_tech = self.kb_by_id.get(tech_id)
+            if full_tech:
+                # Layer score and ranking info over the KB entry without copying it;
+                # writes land in the front map, so the KB itself is never modified
+                techniques.append(ChainMap({
+                    'similarity_score': score,
+                    'match_distance': score  # Lower is better
+                }, full_tech))
+
+        return techniques
+
+    def _search_uncached(self, query: str, top_k: int) -> Tuple[Tuple[str, float], ...]:
+        """Vector search returning (technique id, distance) pairs"""
+        results = self.vectorstore.similarity_search_with_score(query, k=top_k)
+        return tuple((result.metadata.get('id'), score) for result, score in results)
+
+    def _open_reformulation_cache(self, path: str) -> Optional[sqlite3.Connection]:
+        """Open the on-disk reformulation cache; None disables caching"""
+        try:
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS reformulations (key TEXT PRIMARY KEY, prompt TEXT NOT NULL)")
+            return conn
+        except sqlite3.Error as e:
+            print(f"Warning: Reformulation cache unavailable ({e})")
+            return None
+
+    def _cached_reformulation(self, key: str) -> Optional[str]:
+        with self._reform_lock:
+            if key in self._reform_memory:
+                return self._reform_memory[key]
+        if self._reform_db is None:
+            return None
+        try:
+            with self._reform_lock:
+                row = self._reform_db.execute("SELECT prompt FROM reformulations WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _store_reformulation(self, key: str, prompt: str):
+        if self._reform_db is not None:
+            try:
+                with self._reform_lock:
+                    self._reform_db.execute("INSERT OR REPLACE INTO reformulations (key, prompt) VALUES (?, ?)", (key, prompt))
+                return
+            except sqlite3.Error as e:
+                print(f"Warning: Could not cache reformulation on disk ({e}), keeping it in memory")
+        # Without the disk cache a streamed preview must still be reused by build_scaffold
+        with self._reform_lock:
+            self._reform_memory[key] = prompt
+            while len(self._reform_memory) > REFORMULATION_MEMORY_SIZE:
+                self._reform_memory.popitem(last=False)
+
+    def _reformulation_prompt(self, query: str, technique: Dict) -> str:
+        """Build the LLM instruction for reformulating query with technique"""
+        return REFORMULATION_PROMPT.format(
+            name=technique['name'],
+            category=technique['category'],
+            evidence=', '.join(technique.get('evidence', ['Unknown'])),
+            use_cases=', '.join(technique.get('use_cases', [])),
+            year=technique.get('year', 'N/A'),
+            query=query,
+            template=technique['template']
+        )
+
+    def _reformulation_key(self, reformulation_prompt: str) -> str:
+        # The prompt embeds the query and every technique field, so KB edits miss the cache
+        return hashlib.sha256(f"{self.llm.model_name}|{reformulation_prompt}".encode()).hexdigest()
+
+    def _reformulate_prompt(self, query: str, technique: Dict) -> str:
         """
-        Build prompt scaffold for query with intelligent reformulation
-        Returns: (scaffold_text, technique_metadata)
+        Intelligently reformulate the user query according to the technique's best practices
         """
+        reformulation_prompt = self._reformulation_prompt(query, technique)
+        cache_key = self._reformulation_key(reformulation_prompt)
+        cached = self._cached_reformulation(cache_key)
+        if cached is not None:
+            return cached
+
+        response = self.llm.invoke(reformulation_prompt)
+        reformulated = response.content.strip()
+        self._store_reformulation(cache_key, reformulated)
+        return reformulated
+
+    def stream_reformulation(self, query: str, technique_id: str = None) -> Iterator[str]:
+        """
+        Stream the reformulated prompt build_scaffold would use, as it is generated
+        The finished text lands in the reformulation cache, so a following build_scaffold reuses it.
+        An LLM failure part-way through propagates and nothing is cached.
+        """
+        technique = self._select_technique(query, technique_id)
+        reformulation_prompt = self._reformulation_prompt(query, technique)
+        cache_key = self._reformulation_key(reformulation_prompt)
+        cached = self._cached_reformulation(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in self.llm.stream(reformulation_prompt):
+            chunks.append(chunk.content)
+            yield chunk.content
+        self._store_reformulation(cache_key, "".join(chunks).strip())
+
+    def _select_technique(self, query: str, technique_id: str = None) -> Dict:
+        """Resolve the requested technique, or auto-select the best match for query"""
         if technique_id:
             # Use specified technique
-            technique = next((t for t in self.kb if t['id'] == technique_id), None)
+            technique = self.kb_by_id.get(technique_id)
             if not technique:
                 raise ValueError(f"Unknown technique: {technique_id}")
-        else:
-            # Auto-select best technique
-            techniques = self.find_technique(query, top_k=1)
-            technique = techniques[0] if techniques else self.kb[0]
+            return technique
+
+        # Auto-select best technique
+        techniques = self.find_technique(query, top_k=1)
+        return techniques[0] if techniques else self.kb[0]
+
+    def build_scaffold(self, query: str, technique_id: str = None,
+                      custom_vars: Dict = None, use_reformulation: bool = True,
+                      raise_on_fallback: bool = False) -> Tuple[str, Dict]:
+        """
+        Build prompt scaffold for query with intelligent reformulation
+        If the reformulation LLM call fails, the raw query is used instead; with
+        raise_on_fallback that result is raised as ReformulationFailed rather than returned
+        Returns: (scaffold_text, technique_metadata)
+        """
+        technique = self._select_technique(query, technique_id)
 
         # Intelligently reformulate the prompt according to the technique
+        reformulation_failed = False
         if use_reformulation:
-            reformulated_prompt = self._reformulate_prompt(query, technique)
+            try:
+                reformulated_prompt = self._reformulate_prompt(query, technique)
+            except Exception as e:
+                # Fallback to the raw query if the LLM fails
+                print(f"Warning: Reformulation failed ({e}), using basic substitution")
+                reformulated_prompt = query
+                reformulation_failed = True
         else:
             # Fallback to basic substitution
-            template = technique['template']
             variables = technique.get('variables', [])
             var_values = custom_vars or {}
 
@@ -160,19 +339,25 @@ REFORMULATED PROMPT (output only the reformulated prompt, no explanations):"""
             if 'instruction' in variables and 'instruction' not in var_values:
                 var_values['instruction'] = query
 
-            reformulated_prompt = template
-            for var in variables:
-                placeholder = f"{{{var}}}"
-                if placeholder in reformulated_prompt:
-                    reformulated_prompt = reformulated_prompt.replace(placeholder, var_values.get(var, f"[{var}]"))
+            reformulated_prompt = self.renderers[technique['id']](var_values)
+
+        # Static per-technique text is prebuilt; only the request fields are joined in
+        head, middle, tail = self.system_prompt_parts[technique['id']]
+        system_prompt = head + query + middle + reformulated_prompt + tail
 
+        if reformulation_failed and raise_on_fallback:
+            raise ReformulationFailed(system_prompt, technique)
+        return system_prompt, technique
+
+    def _build_system_prompt_parts(self, technique: Dict) -> Tuple[str, str, str]:
+        """
+        Split a technique's system prompt around the per-request fields
+        Returns: (head, middle, tail) to join as head + query + middle + reformulated + tail
+        """
         # Get evidence/citations for display
         evidence_list = technique.get('evidence', ['Unknown'])
-        if isinstance(evidence_list, str):
-            evidence_list = [e.strip() for e in evidence_list.split(',')]
 
-        # Build comprehensive system prompt
-        system_prompt = f"""You are an AI assistant using the "{technique['name']}" prompt engineering technique.
+        head = f"""You are an AI assistant using the "{technique['name']}" prompt engineering technique.
 
 TECHNIQUE INFORMATION:
 - Name: {technique['name']}
@@ -182,10 +367,12 @@ TECHNIQUE INFORMATION:
 - Optimized for: {', '.join(technique.get('use_cases', []))}
 
 ORIGINAL USER REQUEST:
-{query}
+"""
+        middle = f"""
 
 OPTIMIZED PROMPT (reformulated using {technique['name']}):
-{reformulated_prompt}
+"""
+        tail = f"""
 
 EXECUTION REQUIREMENTS:
 - Follow the technique's methodology exactly as defined in the research
@@ -196,12 +383,17 @@ EXECUTION REQUIREMENTS:
   <technique>{technique['name']}</technique>
   <refs>{'; '.join(evidence_list)}</refs>
 """
-
-        return system_prompt, technique
+        return head, middle, tail
 
     def build_multi_agent_scaffold(self, query: str, agents: List[str]) -> str:
         """Build scaffold with multiple agents"""
-        agent_list = "\n".join([f"{i+1}. **{agent}**" for i, agent in enumerate(agents)])
+        # One walk over agents for both the roster and the response sections
+        roster, sections = [], []
+        for i, agent in enumerate(agents, 1):
+            roster.append(f"{i}. **{agent}**")
+            sections.append(f"## {agent} Analysis")
+        agent_list = "\n".join(roster)
+        agent_sections = "\n".join(sections)
 
         scaffold = f"""You orchestrate {len(agents)} specialized agents:
 
@@ -215,7 +407,7 @@ PROCESS:
 3. You synthesize all findings into a cohesive solution
 
 Respond with clear sections:
-{chr(10).join([f"## {agent} Analysis" for agent in agents])}
+{agent_sections}
 
 ## Synthesized Solution
 [Your integrated response]
@@ -226,12 +418,10 @@ Respond with clear sections:
 
     def get_techniques_by_category(self, category: str) -> List[Dict]:
         """Get all techniques in a category"""
+        if category in self.kb_by_category:
+            return list(self.kb_by_category[category])
         return [t for t in self.kb if t.get('category', '').startswith(category)]
 
     def get_all_categories(self) -> List[str]:
-        """Get unique categories"""
-        categories = set()
-        for t in self.kb:
-            cat = t.get('category', 'Unknown')
-            categories.add(cat.split('/')[0])  # Get top-level category
-        return sorted(list(categories))
+        """Get unique top-level categories"""
+        return list(self.categories)